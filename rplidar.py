@@ -22,14 +22,20 @@ Usage example:
 
 For additional information please refer to the RPLidar class documentation.
 '''
-import codecs
 import logging
 import struct
-import sys
 import time
+from functools import reduce
+from operator import xor
 
+import numpy as np
 import pigpio
 
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
 SYNC_BYTE = b'\xA5'
 SYNC_BYTE2 = b'\x5A'
 
@@ -43,6 +49,9 @@ SCAN_BYTE = b'\x20'
 FORCE_SCAN_BYTE = b'\x21'
 
 DESCRIPTOR_LEN = 7
+# Descriptor layout: two sync bytes, 30-bit response size with 2-bit send
+# mode in the upper bits, and data type
+_DESCRIPTOR = struct.Struct('<BBIB')
 INFO_LEN = 20
 HEALTH_LEN = 3
 
@@ -50,39 +59,111 @@ INFO_TYPE = 4
 HEALTH_TYPE = 6
 SCAN_TYPE = 129
 
+# Delay between serial reads while waiting for data, in seconds
+POLL_INTERVAL = .0002
+# Number of measurements requested by a single serial read
+READ_BATCH = 128
+
 # Constants & Command to start A2 motor
 MAX_MOTOR_PWM = 1023
 DEFAULT_MOTOR_PWM = 660
 SET_PWM_BYTE = b'\xF0'
 
-_HEALTH_STATUSES = {
-    0: 'Good',
-    1: 'Warning',
-    2: 'Error',
+# Complete requests for the commands without payload
+_REQ_STOP = SYNC_BYTE + STOP_BYTE
+_REQ_RESET = SYNC_BYTE + RESET_BYTE
+_REQ_INFO = SYNC_BYTE + GET_INFO_BYTE
+_REQ_HEALTH = SYNC_BYTE + GET_HEALTH_BYTE
+_REQ_SCAN = SYNC_BYTE + SCAN_BYTE
+
+_REQUESTS = {
+    STOP_BYTE: _REQ_STOP,
+    RESET_BYTE: _REQ_RESET,
+    GET_INFO_BYTE: _REQ_INFO,
+    GET_HEALTH_BYTE: _REQ_HEALTH,
+    SCAN_BYTE: _REQ_SCAN,
 }
 
+_HEALTH_STATUSES = ('Good', 'Warning', 'Error')
 
-class RPLidarException(Exception):
-    '''Basic exception class for RPLidar'''
+# Scan angle is sent in 1/64 degree and distance in 1/4 mm units
+_ANGLE_SCALE = 1. / 64.
+_DIST_SCALE = .25
 
 
-def _b2i(byte):
-    '''Converts byte to integer (for Python 2 compatability)'''
-    return byte if int(sys.version[0]) == 3 else ord(byte)
+class RPLidarException(Exception):
+    '''Basic exception class for RPLidar'''
 
 
 def _process_scan(raw):
     '''Processes input raw data and returns measurement data'''
-    new_scan = bool(_b2i(raw[0]) & 0b1)
-    inversed_new_scan = bool((_b2i(raw[0]) >> 1) & 0b1)
-    quality = _b2i(raw[0]) >> 2
-    if new_scan == inversed_new_scan:
+    value = int.from_bytes(raw, 'little')
+    flags = value & 0b11
+    if flags == 0b00 or flags == 0b11:
+        raise RPLidarException('New scan flags mismatch')
+    if not (value >> 8) & 0b1:
+        raise RPLidarException('Check bit not equal to 1')
+    new_scan = bool(flags & 0b1)
+    quality = (value >> 2) & 0x3F
+    angle = ((value >> 9) & 0x7FFF) * _ANGLE_SCALE
+    distance = ((value >> 24) & 0xFFFF) * _DIST_SCALE
+    return new_scan, quality, angle, distance
+
+
+_SCAN_ERRORS = (
+    None,
+    'New scan flags mismatch',
+    'Check bit not equal to 1',
+)
+
+if njit is None:
+    _decode_scans = None
+else:
+    @njit(cache=True, boundscheck=False, nogil=True)
+    def _decode_scans(buf, new_scan, quality, angle, distance):
+        '''Decodes raw scan responses of shape (N, 5) into the output
+        arrays. Returns non-zero `_SCAN_ERRORS` index on malformed data.'''
+        for i in range(buf.shape[0]):
+            b0 = buf[i, 0]
+            b1 = buf[i, 1]
+            if (b0 & 0b1) == ((b0 >> 1) & 0b1):
+                return 1
+            if not b1 & 0b1:
+                return 2
+            new_scan[i] = b0 & 0b1
+            quality[i] = b0 >> 2
+            angle[i] = ((b1 >> 1) |
+                        (np.uint32(buf[i, 2]) << 7)) * _ANGLE_SCALE
+            distance[i] = (np.uint32(buf[i, 3]) |
+                           (np.uint32(buf[i, 4]) << 8)) * _DIST_SCALE
+        return 0
+
+
+def _process_scans(raw):
+    '''Processes a batch of raw scan responses at once and returns
+    measurement data as arrays'''
+    buf = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 5)
+    if _decode_scans is not None:
+        count = len(buf)
+        new_scan = np.empty(count, dtype=np.bool_)
+        quality = np.empty(count, dtype=np.uint8)
+        angle = np.empty(count)
+        distance = np.empty(count)
+        error = _decode_scans(buf, new_scan, quality, angle, distance)
+        if error:
+            raise RPLidarException(_SCAN_ERRORS[error])
+        return new_scan, quality, angle, distance
+    b0, b1, b2, b3, b4 = buf.T
+    if not ((b0 & 0b1) ^ ((b0 >> 1) & 0b1)).all():
         raise RPLidarException('New scan flags mismatch')
-    check_bit = _b2i(raw[1]) & 0b1
-    if check_bit != 1:
+    if not (b1 & 0b1).all():
         raise RPLidarException('Check bit not equal to 1')
-    angle = ((_b2i(raw[1]) >> 1) + (_b2i(raw[2]) << 7)) / 64.
-    distance = (_b2i(raw[3]) + (_b2i(raw[4]) << 8)) / 4.
+    new_scan = (b0 & 0b1).astype(bool)
+    quality = b0 >> 2
+    angle = ((b1 >> 1).astype(np.uint32) |
+             (b2.astype(np.uint32) << 7)) * _ANGLE_SCALE
+    distance = (b3.astype(np.uint32) |
+                (b4.astype(np.uint32) << 8)) * _DIST_SCALE
     return new_scan, quality, angle, distance
 
 
@@ -148,6 +229,8 @@ class RPLidar(object):
 
     def start_motor(self):
         '''Starts sensor motor'''
+        if self.motor_running:
+            return
         self.logger.info('Starting motor')
         if self.motor_pin is not None:
             self.pi.write(self.motor_pin, 1)
@@ -155,6 +238,8 @@ class RPLidar(object):
 
     def stop_motor(self):
         '''Stops sensor motor'''
+        if self.motor_running is False:
+            return
         self.logger.info('Stopping motor')
         if self.motor_pin is not None:
             self.pi.write(self.motor_pin, 0)
@@ -162,44 +247,61 @@ class RPLidar(object):
 
     def _send_payload_cmd(self, cmd, payload):
         '''Sends `cmd` command with `payload` to the sensor'''
-        size = struct.pack('B', len(payload))
-        req = SYNC_BYTE + cmd + size + payload
-        checksum = 0
-        for v in struct.unpack('B' * len(req), req):
-            checksum ^= v
-        req += struct.pack('B', checksum)
+        size = len(payload)
+        req = bytearray(size + 4)
+        req[0:1] = SYNC_BYTE
+        req[1:2] = cmd
+        req[2] = size
+        req[3:-1] = payload
+        # The checksum byte is still zero, so it does not affect the result
+        req[-1] = reduce(xor, req, 0)
         self.pi.serial_write(self._serial_port, req)
         self.logger.debug('Command sent: %s' % req)
 
     def _send_cmd(self, cmd):
         '''Sends `cmd` command to the sensor'''
-        req = SYNC_BYTE + cmd
+        req = _REQUESTS.get(cmd) or SYNC_BYTE + cmd
         self.pi.serial_write(self._serial_port, req)
         self.logger.debug('Command sent: %s' % req)
 
+    def _serial_read(self, size):
+        '''Reads up to `size` bytes which are available in the serial port
+        input buffer'''
+        count, data = self.pi.serial_read(self._serial_port, size)
+        if count < 0:
+            raise RPLidarException('Failed to read from the sensor due '
+                                   'to: %s' % pigpio.error_text(count))
+        return data
+
+    def _read(self, size):
+        '''Reads up to `size` bytes, waiting at most `self.timeout` seconds
+        for them to arrive'''
+        deadline = time.monotonic() + self.timeout
+        data = bytearray()
+        while len(data) < size and time.monotonic() < deadline:
+            chunk = self._serial_read(size - len(data))
+            if chunk:
+                data += chunk
+            else:
+                time.sleep(POLL_INTERVAL)
+        return data
+
     def _read_descriptor(self):
         '''Reads descriptor packet'''
-        for _ in range(self.timeout * 1000):
-            if self.pi.serial_data_available(self._serial_port) >= DESCRIPTOR_LEN:
-                break
-            time.sleep(.001)
-        descriptor = self.pi.serial_read(self._serial_port, DESCRIPTOR_LEN)[1]
+        descriptor = self._read(DESCRIPTOR_LEN)
         self.logger.debug('Recieved descriptor: %s', descriptor)
         if len(descriptor) != DESCRIPTOR_LEN:
             raise RPLidarException('Descriptor length mismatch')
-        elif not descriptor.startswith(SYNC_BYTE + SYNC_BYTE2):
+        sync, sync2, size_mode, dtype = _DESCRIPTOR.unpack(descriptor)
+        if sync != SYNC_BYTE[0] or sync2 != SYNC_BYTE2[0]:
             raise RPLidarException('Incorrect descriptor starting bytes')
-        is_single = _b2i(descriptor[-2]) == 0
-        return _b2i(descriptor[2]), is_single, _b2i(descriptor[-1])
+        is_single = size_mode >> 30 == 0
+        return size_mode & 0x3FFFFFFF, is_single, dtype
 
     def _read_response(self, dsize):
         '''Reads response packet with length of `dsize` bytes'''
-        for _ in range(self.timeout * 1000):
-            if self.pi.serial_data_available(self._serial_port) >= dsize:
-                break
-            time.sleep(.001)
         self.logger.debug('Trying to read response: %d bytes', dsize)
-        data = self.pi.serial_read(self._serial_port, dsize)[1]
+        data = self._read(dsize)
         self.logger.debug('Recieved data: %s', data)
         if len(data) != dsize:
             raise RPLidarException('Wrong body size')
@@ -222,12 +324,11 @@ class RPLidar(object):
         if dtype != INFO_TYPE:
             raise RPLidarException('Wrong response data type')
         raw = self._read_response(dsize)
-        serialnumber = codecs.encode(raw[4:], 'hex').upper()
-        serialnumber = codecs.decode(serialnumber, 'ascii')
+        serialnumber = raw[4:].hex().upper()
         data = {
-            'model': _b2i(raw[0]),
-            'firmware': (_b2i(raw[2]), _b2i(raw[1])),
-            'hardware': _b2i(raw[3]),
+            'model': raw[0],
+            'firmware': (raw[2], raw[1]),
+            'hardware': raw[3],
             'serialnumber': serialnumber,
         }
         return data
@@ -256,8 +357,8 @@ class RPLidar(object):
         if dtype != HEALTH_TYPE:
             raise RPLidarException('Wrong response data type')
         raw = self._read_response(dsize)
-        status = _HEALTH_STATUSES[_b2i(raw[0])]
-        error_code = (_b2i(raw[1]) << 8) + _b2i(raw[2])
+        status = _HEALTH_STATUSES[raw[0]]
+        error_code = (raw[1] << 8) + raw[2]
         return status, error_code
 
     def clear_input(self):
@@ -308,20 +409,44 @@ class RPLidar(object):
             raise RPLidarException('Wrong response data type')
         return dsize
 
-    def _check_buffer(self, max_buf_meas, dsize):
-        '''Checks how much data is in buffer and erases it if it exceeds max_buf_meas.'''
-        data_in_buf = self.pi.serial_data_available(
-            self._serial_port)
-        if data_in_buf > max_buf_meas * dsize:
+    def _check_buffer(self, max_buf_size, dsize, partial=0):
+        '''Checks how much data is in buffer and erases it if it exceeds
+        `max_buf_size` bytes.
+
+        `partial` is the number of bytes of an incomplete measurement which
+        were already read. The buffer is erased up to the next measurement
+        boundary, so the caller must drop those bytes if True is returned.'''
+        port = self._serial_port
+        data_in_buf = self.pi.serial_data_available(port)
+        if data_in_buf > max_buf_size:
             self.logger.warning(
                 'Too many measurements in the input buffer: %d/%d. '
                 'Clearing buffer...',
-                data_in_buf // dsize, max_buf_meas)
-            self.pi.serial_read(self._serial_port,
-                                data_in_buf // dsize * dsize)
+                data_in_buf // dsize, max_buf_size // dsize)
+            self.pi.serial_read(port,
+                                data_in_buf - (data_in_buf + partial) % dsize)
             return True
         return False
 
+    def _iter_chunks(self, read_size):
+        '''Iterates over chunks of at most `read_size` bytes read from the
+        serial port. Raises RPLidarException if no data arrives within
+        `self.timeout` seconds.'''
+        read = self._serial_read
+        debug = self.logger.debug
+        monotonic = time.monotonic
+        deadline = monotonic() + self.timeout
+        while True:
+            raw = read(read_size)
+            if not raw:
+                if monotonic() > deadline:
+                    raise RPLidarException('Timed out waiting for scan data')
+                time.sleep(POLL_INTERVAL)
+                continue
+            deadline = monotonic() + self.timeout
+            debug('Recieved scan response: %s', raw)
+            yield raw
+
     def iter_measurements(self, max_buf_meas=500):
         '''Iterate over measurements. Note that consumer must be fast enough,
         otherwise data will be accumulated inside buffer and consumer will get
@@ -346,12 +471,60 @@ class RPLidar(object):
             In millimeter unit. Set to 0 when measurement is invalid.
         '''
         dsize = self._setup_iter()
-        while True:
-            raw = self._read_response(dsize)
-            self.logger.debug('Recieved scan response: %s' % raw)
-            if max_buf_meas:
-                self._check_buffer(max_buf_meas, dsize)
-            yield _process_scan(raw)
+        max_buf_size = max_buf_meas * dsize
+        read_size = READ_BATCH * dsize
+        check_buffer = self._check_buffer
+        process_scan = _process_scan
+        backlog = bytearray()
+        for raw in self._iter_chunks(read_size):
+            backlog += raw
+            partial = len(backlog) % dsize
+            # A short read means that the input buffer was drained, so it
+            # only has to be checked after a full one
+            if (max_buf_size and len(raw) == read_size and
+                    check_buffer(max_buf_size, dsize, partial)):
+                del backlog[len(backlog) - partial:]
+            offset = 0
+            end = len(backlog) - dsize
+            with memoryview(backlog) as view:
+                while offset <= end:
+                    yield process_scan(view[offset:offset + dsize])
+                    offset += dsize
+            del backlog[:offset]
+
+    def _iter_scan_runs(self, max_buf_meas):
+        '''Iterates over runs of consecutive measurements which do not cross
+        a scan boundary. Yields `(scan_end, quality, angle, distance)`, where
+        the last three are arrays and `scan_end` is True if a new scan starts
+        right after the run.'''
+        dsize = self._setup_iter()
+        max_buf_size = max_buf_meas * dsize
+        read_size = READ_BATCH * dsize
+        check_buffer = self._check_buffer
+        process_scans = _process_scans
+        flatnonzero = np.flatnonzero
+        backlog = bytearray()
+        for raw in self._iter_chunks(read_size):
+            backlog += raw
+            size = len(backlog) - len(backlog) % dsize
+            if not size:
+                continue
+            new_scans, qualities, angles, distances = \
+                process_scans(backlog[:size])
+            del backlog[:size]
+            # A short read means that the input buffer was drained, so it
+            # only has to be checked after a full one
+            check = max_buf_size and len(raw) == read_size
+            start = 0
+            for end in flatnonzero(new_scans).tolist():
+                yield (True, qualities[start:end], angles[start:end],
+                       distances[start:end])
+                start = end
+                if check and check_buffer(max_buf_size, dsize, len(backlog)):
+                    del backlog[:]
+                    break
+            else:
+                yield False, qualities[start:], angles[start:], distances[start:]
 
     def iter_scans(self, max_buf_meas=500, min_len=5):
         '''Iterate over scans. Note that consumer must be fast enough,
@@ -373,22 +546,62 @@ class RPLidar(object):
             format: (quality, angle, distance). For values description please
             refer to `iter_measurements` method's documentation.
         '''
-        dsize = self._setup_iter()
         scan = []
-        while True:
-            data_in_buf = self.pi.serial_data_available(self._serial_port)
-            raw = self._read_response(data_in_buf // dsize * dsize)
-            self.logger.debug('Recieved scan response: %s' % raw)
-            measurements = (_process_scan(
-                raw[i * dsize:(i + 1) * dsize]) for i in range(data_in_buf // dsize))
-            for new_scan, quality, angle, distance in measurements:
-                if new_scan:
-                    if len(scan) > min_len:
-                        yield scan
-                    scan = []
-                    if max_buf_meas and self._check_buffer(max_buf_meas, dsize):
-                        break
-                scan.append((quality, angle, distance))
+        for scan_end, qualities, angles, distances in \
+                self._iter_scan_runs(max_buf_meas):
+            scan.extend(zip(qualities.tolist(), angles.tolist(),
+                            distances.tolist()))
+            if scan_end:
+                if len(scan) > min_len:
+                    yield scan
+                scan = []
+
+    def iter_scan_arrays(self, max_buf_meas=500, min_len=5):
+        '''Iterate over scans with measurements stored as arrays. Works the
+        same way as `iter_scans`, but avoids creating a tuple for every
+        measurement and its output can be processed with numpy directly.
+
+        Parameters
+        ----------
+        max_buf_meas : int
+            Maximum number of measurements to be stored inside the buffer. Once
+            numbe exceeds this limit buffer will be emptied out.
+        min_len : int
+            Minimum number of measurements in the scan for it to be yelded.
+
+        Yields
+        ------
+        scan : dict
+            Dictionary with 'quality' (uint8), 'angle' (float32) and
+            'distance' (float32) arrays, which hold the scan measurements.
+            For values description please refer to `iter_measurements`
+            method's documentation.
+        '''
+        capacity = 768
+        quality = np.empty(capacity, dtype=np.uint8)
+        angle = np.empty(capacity, dtype=np.float32)
+        distance = np.empty(capacity, dtype=np.float32)
+        size = 0
+        for scan_end, qualities, angles, distances in \
+                self._iter_scan_runs(max_buf_meas):
+            end = size + len(qualities)
+            if end > capacity:
+                capacity = 2 * end
+                quality = np.resize(quality, capacity)
+                angle = np.resize(angle, capacity)
+                distance = np.resize(distance, capacity)
+            quality[size:end] = qualities
+            angle[size:end] = angles
+            distance[size:end] = distances
+            size = end
+            if scan_end:
+                if size > min_len:
+                    yield {
+                        'quality': quality[:size].copy(),
+                        'angle': angle[:size].copy(),
+                        'distance': distance[:size].copy(),
+                    }
+                size = 0
 
     def __del__(self):
         '''Disconnects from the serial port'''
@@ -13,11 +13,10 @@ setup(
     author_email='newpavlov@gmail.com',
     url='https://github.com/timfromme/rplidar_pigpio',
     license='MIT',
-    install_requires=['pigpio'],
+    install_requires=['numpy', 'pigpio'],
     zip_safe=True,
     long_description='This module aims to implement communication protocol '
-        'with RPLidar laser scanners. It\'s Python 2 and 3 '
-        'compatible but was mainly tested using Python 3.',
+        'with RPLidar laser scanners.',
     classifiers=[
         'Development Status :: 4 - Beta',
         'Environment :: Console',
@@ -27,7 +26,6 @@ setup(
         'Operating System :: Microsoft',
         'Operating System :: POSIX',
         'Operating System :: Unix',
-        'Programming Language :: Python :: 2',
         'Programming Language :: Python :: 3',
         'Topic :: System :: Hardware',
     ],